@@ -1,6 +1,5 @@
 import streamlit as st
-from PIL import Image
-import io
+from png_io import load_png, preview_bytes, download_bytes
 
 # Set page configuration
 st.set_page_config(
@@ -24,14 +23,14 @@ uploaded_file = st.file_uploader(
 if uploaded_file is not None:
     try:
         # Read and display the image
-        image = Image.open(uploaded_file)
+        image, raw, key = load_png(uploaded_file)
         
         # Create two columns for layout
         col1, col2 = st.columns([2, 1])
         
         with col1:
             st.subheader("Uploaded Diagram")
-            st.image(image, use_container_width=True)
+            st.image(preview_bytes(key, raw), use_container_width=True)
         
         with col2:
             st.subheader("Image Details")
@@ -41,14 +40,10 @@ if uploaded_file is not None:
             st.write(f"**Format:** {image.format}")
             st.write(f"**Mode:** {image.mode}")
             
-            # Download button
-            buf = io.BytesIO()
-            image.save(buf, format='PNG')
-            byte_im = buf.getvalue()
-            
+            # Download button - PNG uploads are served as-is
             st.download_button(
                 label="Download Image",
-                data=byte_im,
+                data=download_bytes(key, raw),
                 file_name=uploaded_file.name,
                 mime="image/png"
             )
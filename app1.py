@@ -5,13 +5,24 @@ Users can upload PNG images and receive detailed analysis of Azure resources.
 """
 
 import streamlit as st
-from PIL import Image
 import io
 import json
-from diagram_analyzer import DiagramAnalyzer
+import logging
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from diagram_analyzer import AnalysisFailed, DiagramAnalyzer, list_models
+from png_io import load_png, decode_png, preview_bytes
 import pandas as pd
 from datetime import datetime
 
+try:
+    import orjson
+except ImportError:  # optional: faster JSON export
+    orjson = None
+
+logger = logging.getLogger(__name__)
+
 # Page configuration
 st.set_page_config(
     page_title="Azure Architecture Diagram Analyzer",
@@ -36,31 +47,86 @@ st.markdown("""
         color: #666;
         margin-bottom: 2rem;
     }
-    .resource-card {
-        background-color: #f0f2f6;
-        padding: 1rem;
-        border-radius: 0.5rem;
-        margin-bottom: 0.5rem;
-        border-left: 4px solid #0078D4;
-    }
-    .stat-box {
-        background-color: #0078D4;
-        color: white;
-        padding: 1rem;
-        border-radius: 0.5rem;
-        text-align: center;
-    }
     </style>
 """, unsafe_allow_html=True)
 
+# Resource fields shared by the table view and the CSV export
+RESOURCE_COLUMNS = ['resource_name', 'resource_type', 'category', 'description', 'connections']
+
+# Header names used for the CSV export, in resource column order
+CSV_COLUMN_NAMES = {
+    'resource_name': 'Resource Name',
+    'resource_type': 'Resource Type',
+    'category': 'Category',
+    'description': 'Description',
+    'connections': 'Connections',
+    'connection_count': 'Connection Count'
+}
+
+ResourceStats = namedtuple('ResourceStats', ['total_resources', 'total_categories', 'total_connections'])
+
+@st.cache_resource(show_spinner=False)
+def _get_analyzer(api_key, model_name, max_dim):
+    """Create one DiagramAnalyzer per (API key, model, size limit) and share it across reruns"""
+    return DiagramAnalyzer(api_key, model_name, max_image_size=max_dim)
+
+@st.cache_resource(show_spinner=False)
+def _get_executor():
+    """Shared worker pool that runs Gemini analyses off the script thread"""
+    return ThreadPoolExecutor(max_workers=4, thread_name_prefix="diagram-analysis")
+
+@st.cache_data(show_spinner=False, ttl=3600)
+def _list_models(api_key):
+    """List the Gemini models that support generateContent for this API key"""
+    return list_models(api_key)
+
+@st.cache_data(show_spinner=False, max_entries=32)
+def _analyze(raw_hash, api_key, model_name, max_dim, _raw):
+    """Run the Gemini analysis once per (image content, API key, model, size limit)"""
+    # The analyzer downscales its own copy, so the original stays intact for the preview
+    result = _get_analyzer(api_key, model_name, max_dim).analyze_diagram(decode_png(raw_hash, _raw))
+    if not result.get('metadata', {}).get('success'):
+        # Raising keeps st.cache_data from storing the failure
+        raise AnalysisFailed(result)
+    return result
+
+@st.cache_data(show_spinner=False, max_entries=32)
+def _resources_df(analysis_key, _resources):
+    """Build the resources DataFrame once per analysis"""
+    df = pd.DataFrame.from_records(_resources, columns=RESOURCE_COLUMNS)
+    df[RESOURCE_COLUMNS[:-1]] = df[RESOURCE_COLUMNS[:-1]].fillna('')
+    df['connections'] = [c if isinstance(c, list) else [] for c in df['connections']]
+    return df
+
+@st.cache_data(show_spinner=False, max_entries=32)
+def _resource_stats(analysis_key, _resources):
+    """Count resources, categories and connections in a single pass"""
+    categories = set()
+    total_connections = 0
+    for r in _resources:
+        categories.add(r.get('category', 'Other'))
+        total_connections += len(r.get('connections') or ())
+    return ResourceStats(len(_resources), len(categories), total_connections)
+
+@st.cache_data(show_spinner=False, max_entries=32)
+def _result_json(analysis_key, _result):
+    """Serialize the analysis result to indented JSON bytes once per analysis"""
+    if orjson is not None:
+        return orjson.dumps(_result, option=orjson.OPT_INDENT_2)
+    
+    json_buf = io.BytesIO()
+    with io.TextIOWrapper(json_buf, encoding='utf-8', write_through=True) as text_buf:
+        json.dump(_result, text_buf, indent=2)
+        return json_buf.getvalue()
+
 def initialize_session_state():
     """Initialize session state variables"""
-    if 'analysis_result' not in st.session_state:
-        st.session_state.analysis_result = None
+    if 'analysis_key' not in st.session_state:
+        st.session_state.analysis_key = None
+    if 'pending_analysis' not in st.session_state:
+        st.session_state.pending_analysis = None
     if 'uploaded_image' not in st.session_state:
         st.session_state.uploaded_image = None
-    if 'analyzer' not in st.session_state:
-        st.session_state.analyzer = None
 
 def display_header():
     """Display the main header"""
@@ -90,21 +156,27 @@ def configure_sidebar():
             help="Select the Gemini model to use for analysis. Flash is faster, Pro is more accurate."
         )
         
+        # Largest image side sent to the model
+        max_dim = st.slider(
+            "Max Image Size (px)",
+            min_value=512,
+            max_value=4096,
+            value=1536,
+            step=64,
+            help="Larger diagrams are downscaled to this size before analysis. Lower values are faster and cheaper."
+        )
+        
         st.markdown("---")
         
         # Test API Key button
         if api_key:
             if st.button("🧪 Test API Key", use_container_width=True):
                 try:
-                    import google.generativeai as genai
-                    genai.configure(api_key=api_key)
-                    models = genai.list_models()
+                    models = _list_models(api_key)
                     st.success("✅ API Key is valid!")
                     
                     with st.expander("📋 Available Models"):
-                        for model in models:
-                            if 'generateContent' in model.supported_generation_methods:
-                                st.text(f"• {model.name}")
+                        st.code("\n".join(models), language=None)
                 except Exception as e:
                     st.error(f"❌ API Key Error: {str(e)}")
         
@@ -161,7 +233,7 @@ def configure_sidebar():
             • Avoid heavily compressed images
             """)
         
-        return api_key, model_name
+        return api_key, model_name, max_dim
 
 def display_upload_section():
     """Display the file upload section"""
@@ -175,64 +247,37 @@ def display_upload_section():
     
     return uploaded_file
 
-def display_image_preview(image):
+def display_image_preview(preview, width, height, image_format):
     """Display the uploaded image preview"""
     st.header("🖼️ Uploaded Diagram")
     
     col1, col2, col3 = st.columns([1, 2, 1])
     with col2:
-        st.image(image, use_container_width=True, caption="Architecture Diagram Preview")
+        st.image(preview, use_container_width=True, caption="Architecture Diagram Preview")
     
     # Display image info
-    width, height = image.size
-    st.caption(f"📏 Image dimensions: {width} x {height} pixels | Format: {image.format}")
+    st.caption(f"📏 Image dimensions: {width} x {height} pixels | Format: {image_format}")
 
-def display_statistics(result):
+def display_statistics(stats, confidence):
     """Display summary statistics in a nice layout"""
     st.header("📊 Analysis Statistics")
     
-    resources = result.get('resources', [])
-    metadata = result.get('metadata', {})
-    
     # Create columns for statistics
     col1, col2, col3, col4 = st.columns(4)
     
     with col1:
-        st.markdown(f"""
-        <div class="stat-box">
-            <h2>{len(resources)}</h2>
-            <p>Total Resources</p>
-        </div>
-        """, unsafe_allow_html=True)
+        st.metric("Total Resources", stats.total_resources)
     
     with col2:
-        categories = set(r.get('category', 'Other') for r in resources)
-        st.markdown(f"""
-        <div class="stat-box">
-            <h2>{len(categories)}</h2>
-            <p>Categories</p>
-        </div>
-        """, unsafe_allow_html=True)
+        st.metric("Categories", stats.total_categories)
     
     with col3:
-        total_connections = sum(len(r.get('connections', [])) for r in resources)
-        st.markdown(f"""
-        <div class="stat-box">
-            <h2>{total_connections}</h2>
-            <p>Connections</p>
-        </div>
-        """, unsafe_allow_html=True)
+        st.metric("Connections", stats.total_connections)
     
     with col4:
-        confidence = result.get('confidence', 'N/A')
-        st.markdown(f"""
-        <div class="stat-box">
-            <h2>{confidence.upper()}</h2>
-            <p>Confidence</p>
-        </div>
-        """, unsafe_allow_html=True)
-
-def display_architecture_overview(result):
+        st.metric("Confidence", confidence.upper())
+
+def display_architecture_overview(pattern, confidence, summary):
     """Display the architecture pattern and summary"""
     st.header("🗺️ Architecture Overview")
     
@@ -240,11 +285,10 @@ def display_architecture_overview(result):
     
     with col1:
         st.subheader("Architecture Pattern")
-        st.info(result.get('architecture_pattern', 'Not identified'))
+        st.info(pattern)
     
     with col2:
         st.subheader("Confidence Level")
-        confidence = result.get('confidence', 'N/A')
         if confidence.lower() == 'high':
             st.success(f"✅ {confidence.upper()}")
         elif confidence.lower() == 'medium':
@@ -253,7 +297,7 @@ def display_architecture_overview(result):
             st.error(f"❌ {confidence.upper()}")
     
     st.subheader("Summary")
-    st.write(result.get('summary', 'No summary available'))
+    st.write(summary)
 
 def display_resources_by_category(result, analyzer):
     """Display resources grouped by category"""
@@ -265,69 +309,59 @@ def display_resources_by_category(result, analyzer):
         st.warning("No resources identified in the diagram.")
         return
     
-    # Create tabs for each category
-    category_tabs = st.tabs(list(categories.keys()))
+    # Render only the selected category; tabs would build every category on each rerun
+    category = st.selectbox(
+        "Category",
+        options=list(categories.keys()),
+        format_func=lambda c: f"{c} ({len(categories[c])})",
+        key="resource_category"
+    )
+    resources = categories[category]
+    
+    st.subheader(f"{category} ({len(resources)} resources)")
     
-    for tab, (category, resources) in zip(category_tabs, categories.items()):
-        with tab:
-            st.subheader(f"{category} ({len(resources)} resources)")
+    for idx, resource in enumerate(resources, 1):
+        with st.container(border=True):
+            st.markdown(f"#### #{idx} {resource.get('resource_name', 'Unnamed Resource')}")
             
-            for idx, resource in enumerate(resources, 1):
-                with st.container():
-                    st.markdown(f"""
-                    <div class="resource-card">
-                        <h4>#{idx} {resource.get('resource_name', 'Unnamed Resource')}</h4>
-                    </div>
-                    """, unsafe_allow_html=True)
-                    
-                    col1, col2 = st.columns([2, 1])
-                    
-                    with col1:
-                        st.write(f"**Type:** {resource.get('resource_type', 'N/A')}")
-                        st.write(f"**Description:** {resource.get('description', 'No description')}")
-                    
-                    with col2:
-                        connections = resource.get('connections', [])
-                        if connections:
-                            st.write("**Connected to:**")
-                            for conn in connections:
-                                st.write(f"→ {conn}")
-                        else:
-                            st.write("**No connections**")
-                    
-                    st.markdown("---")
+            col1, col2 = st.columns([2, 1])
+            
+            with col1:
+                st.write(f"**Type:** {resource.get('resource_type', 'N/A')}")
+                st.write(f"**Description:** {resource.get('description', 'No description')}")
+            
+            with col2:
+                connections = resource.get('connections', [])
+                if connections:
+                    st.write("**Connected to:**")
+                    for conn in connections:
+                        st.write(f"→ {conn}")
+                else:
+                    st.write("**No connections**")
 
-def display_resources_table(result):
+def display_resources_table(resources_df):
     """Display all resources in a table format"""
     st.header("📋 All Resources (Table View)")
     
-    resources = result.get('resources', [])
-    
-    if not resources:
+    if resources_df.empty:
         st.warning("No resources to display.")
         return
     
-    # Create DataFrame
-    df_data = []
-    for resource in resources:
-        df_data.append({
-            'Resource Name': resource.get('resource_name', ''),
-            'Type': resource.get('resource_type', ''),
-            'Category': resource.get('category', ''),
-            'Connections': len(resource.get('connections', [])),
-            'Description': resource.get('description', '')[:100] + '...' if len(resource.get('description', '')) > 100 else resource.get('description', '')
-        })
-    
-    df = pd.DataFrame(df_data)
+    # Create DataFrame, truncating long descriptions column-wise
+    table = resources_df[['resource_name', 'resource_type', 'category', 'description']].copy()
+    table.insert(3, 'connection_count', [len(c) for c in resources_df['connections']])
+    mask = table['description'].str.len() > 100
+    table.loc[mask, 'description'] = table.loc[mask, 'description'].str.slice(0, 100) + '...'
+    table.columns = ['Resource Name', 'Type', 'Category', 'Connections', 'Description']
     
     # Display with filtering
     st.dataframe(
-        df,
+        table,
         use_container_width=True,
         hide_index=True
     )
 
-def display_export_options(result, analyzer):
+def display_export_options(json_bytes, resources, resources_df, pattern, summary, confidence):
     """Display export options for the analysis results"""
     st.header("💾 Export Results")
     
@@ -335,10 +369,9 @@ def display_export_options(result, analyzer):
     
     with col1:
         # Export as JSON
-        json_str = json.dumps(result, indent=2)
         st.download_button(
             label="📄 Download JSON",
-            data=json_str,
+            data=json_bytes,
             file_name=f"azure_analysis_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json",
             mime="application/json",
             use_container_width=True
@@ -346,25 +379,17 @@ def display_export_options(result, analyzer):
     
     with col2:
         # Export as CSV
-        resources = result.get('resources', [])
-        if resources:
-            df_data = []
-            for resource in resources:
-                df_data.append({
-                    'Resource Name': resource.get('resource_name', ''),
-                    'Resource Type': resource.get('resource_type', ''),
-                    'Category': resource.get('category', ''),
-                    'Description': resource.get('description', ''),
-                    'Connections': '; '.join(resource.get('connections', [])),
-                    'Connection Count': len(resource.get('connections', []))
-                })
-            
-            df = pd.DataFrame(df_data)
-            csv = df.to_csv(index=False)
+        if not resources_df.empty:
+            df = resources_df.copy()
+            df['connection_count'] = df['connections'].map(len)
+            df['connections'] = df['connections'].map('; '.join)
+            df = df.rename(columns=CSV_COLUMN_NAMES)
+            csv_buf = io.BytesIO()
+            df.to_csv(csv_buf, index=False, encoding='utf-8')
             
             st.download_button(
                 label="📊 Download CSV",
-                data=csv,
+                data=csv_buf.getvalue(),
                 file_name=f"azure_resources_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv",
                 mime="text/csv",
                 use_container_width=True
@@ -372,29 +397,33 @@ def display_export_options(result, analyzer):
     
     with col3:
         # Export full report as text
-        report = f"""Azure Architecture Analysis Report
+        buf = io.StringIO()
+        w = buf.write
+        w(f"""Azure Architecture Analysis Report
 Generated: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}
 
 ARCHITECTURE PATTERN
-{result.get('architecture_pattern', 'N/A')}
+{pattern}
 
 SUMMARY
-{result.get('summary', 'N/A')}
+{summary}
 
 CONFIDENCE LEVEL
-{result.get('confidence', 'N/A')}
+{confidence}
 
 RESOURCES IDENTIFIED
-Total: {len(result.get('resources', []))}
+Total: {len(resources)}
 
-"""
-        for idx, resource in enumerate(result.get('resources', []), 1):
-            report += f"\n{idx}. {resource.get('resource_name', 'Unnamed')}\n"
-            report += f"   Type: {resource.get('resource_type', 'N/A')}\n"
-            report += f"   Category: {resource.get('category', 'N/A')}\n"
-            report += f"   Description: {resource.get('description', 'N/A')}\n"
-            if resource.get('connections'):
-                report += f"   Connections: {', '.join(resource.get('connections'))}\n"
+""")
+        for idx, resource in enumerate(resources, 1):
+            w(f"\n{idx}. {resource.get('resource_name', 'Unnamed')}\n")
+            w(f"   Type: {resource.get('resource_type', 'N/A')}\n")
+            w(f"   Category: {resource.get('category', 'N/A')}\n")
+            w(f"   Description: {resource.get('description', 'N/A')}\n")
+            connections = resource.get('connections')
+            if connections:
+                w(f"   Connections: {', '.join(connections)}\n")
+        report = buf.getvalue()
         
         st.download_button(
             label="📝 Download Report",
@@ -410,20 +439,24 @@ def main():
     display_header()
     
     # Configure sidebar and get settings
-    api_key, model_name = configure_sidebar()
+    api_key, model_name, max_dim = configure_sidebar()
     
     # Main content area
     uploaded_file = display_upload_section()
+    analysis_running = False
     
     # Process uploaded file
     if uploaded_file is not None:
         try:
             # Convert uploaded file to PIL Image
-            image = Image.open(uploaded_file)
+            image, raw, raw_hash = load_png(uploaded_file)
             st.session_state.uploaded_image = image
+            width, height = image.size
+            image_format = image.format
+            analysis_key = (raw_hash, api_key, model_name, max_dim)
             
             # Display image preview
-            display_image_preview(image)
+            display_image_preview(preview_bytes(raw_hash, raw), width, height, image_format)
             
             # Analyze button
             st.markdown("---")
@@ -436,65 +469,84 @@ def main():
                     use_container_width=True
                 )
             
-            # Perform analysis
+            # Start the analysis on the worker pool so the page stays interactive
             if analyze_button:
                 if not api_key:
                     st.error("⚠️ Please enter your Google Gemini API key in the sidebar!")
                 else:
+                    future = _get_executor().submit(_analyze, raw_hash, api_key, model_name, max_dim, raw)
+                    st.session_state.pending_analysis = (analysis_key, future)
+            
+            # Check on an in-flight analysis for the current image and settings
+            pending = st.session_state.pending_analysis
+            if pending is not None and pending[0] == analysis_key:
+                future = pending[1]
+                if not future.done():
+                    analysis_running = True
+                    st.status("🔄 Analyzing your architecture diagram... This may take 10-30 seconds...", state="running")
+                else:
+                    st.session_state.pending_analysis = None
                     try:
-                        with st.spinner("🔄 Analyzing your architecture diagram... This may take 10-30 seconds..."):
-                            # Initialize analyzer if not already done
-                            if st.session_state.analyzer is None or st.session_state.analyzer.api_key != api_key:
-                                st.session_state.analyzer = DiagramAnalyzer(api_key, model_name)
-                            
-                            # Perform analysis
-                            result = st.session_state.analyzer.analyze_diagram(image)
-                            st.session_state.analysis_result = result
-                        
-                        if result.get('metadata', {}).get('success'):
-                            st.success("✅ Analysis completed successfully!")
-                        else:
-                            st.error(f"⚠️ Analysis encountered issues: {result.get('summary', 'Unknown error')}")
+                        future.result()
+                        st.session_state.analysis_key = analysis_key
+                        st.status("✅ Analysis completed successfully!", state="complete")
                     
+                    except AnalysisFailed as e:
+                        st.error(f"⚠️ Analysis encountered issues: {e}")
                     except Exception as e:
+                        logger.exception("Diagram analysis failed")
                         st.error(f"❌ Error during analysis: {str(e)}")
-                        st.exception(e)
+                        with st.expander("Show traceback (debug)"):
+                            st.exception(e)
             
-            # Display results if available
-            if st.session_state.analysis_result is not None:
-                result = st.session_state.analysis_result
+            # Display results if available (served from the analysis cache on reruns)
+            if st.session_state.analysis_key == analysis_key:
+                try:
+                    result = _analyze(raw_hash, api_key, model_name, max_dim, raw)
+                except AnalysisFailed as e:
+                    # Re-analysis after a cache eviction failed; don't keep showing it
+                    st.session_state.analysis_key = None
+                    result = e.result
                 
                 if result.get('metadata', {}).get('success'):
+                    resources = result.get('resources') or []
+                    pattern = result.get('architecture_pattern', 'Not identified')
+                    confidence = result.get('confidence', 'N/A')
+                    summary = result.get('summary', 'No summary available')
+                    resources_df = _resources_df(analysis_key, resources)
+                    
                     st.markdown("---")
                     
                     # Display statistics
-                    display_statistics(result)
+                    display_statistics(_resource_stats(analysis_key, resources), confidence)
                     
                     st.markdown("---")
                     
                     # Display architecture overview
-                    display_architecture_overview(result)
+                    display_architecture_overview(pattern, confidence, summary)
                     
                     st.markdown("---")
                     
                     # Display resources by category
-                    display_resources_by_category(result, st.session_state.analyzer)
+                    display_resources_by_category(result, _get_analyzer(api_key, model_name, max_dim))
                     
                     st.markdown("---")
                     
                     # Display resources table
-                    display_resources_table(result)
+                    display_resources_table(resources_df)
                     
                     st.markdown("---")
                     
                     # Display export options
-                    display_export_options(result, st.session_state.analyzer)
+                    display_export_options(_result_json(analysis_key, result), resources, resources_df, pattern, summary, confidence)
                 else:
-                    st.error("Analysis was not successful. Please check the error message above.")
+                    st.error(f"⚠️ Analysis was not successful: {result.get('summary', 'Unknown error')}")
         
         except Exception as e:
+            logger.exception("Failed to process uploaded image")
             st.error(f"❌ Error processing image: {str(e)}")
-            st.exception(e)
+            with st.expander("Show traceback (debug)"):
+                st.exception(e)
     
     else:
         # Show example/help when no file is uploaded
@@ -520,6 +572,11 @@ def main():
         st.write("• Detailed information about each component")
         st.write("• Connection mappings between resources")
         st.write("• Architecture pattern recognition")
+    
+    # Poll the in-flight analysis; any widget interaction cuts the wait short
+    if analysis_running:
+        time.sleep(1)
+        st.rerun()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -5,12 +5,327 @@ using Google's Gemini AI model.
 """
 
 import google.generativeai as genai
+from google.generativeai import client as genai_client
 from PIL import Image
 import json
 import io
-from typing import Dict, List, Any
+import asyncio
+import copy
+import hashlib
+import threading
+import weakref
+from collections import OrderedDict, defaultdict
+from datetime import datetime, timezone
+from typing import Dict, List, Any, Optional, Tuple
 import re
 
+try:
+    import orjson
+    # orjson.JSONDecodeError subclasses json.JSONDecodeError, so handlers are unchanged
+    _json_loads = orjson.loads
+except ImportError:  # optional: faster JSON parsing
+    _json_loads = json.loads
+
+
+# What to extract from each diagram; shared by the single and batch prompts
+_ANALYSIS_CHECKLIST = """
+1. **All Azure Resources**: Look for service icons, labels, and text
+2. **Resource Types**: Specific Azure service names (e.g., App Service, Storage Account, SQL Database)
+3. **Resource Names**: Any custom names or labels given to resources
+4. **Categories**: Classify each resource (Compute, Storage, Database, Networking, Security, Analytics, AI/ML, DevOps, Integration, Identity, Monitoring, Other)
+5. **Connections**: Identify which resources connect to which (arrows, lines, or implied relationships)
+6. **Architecture Pattern**: Identify the overall pattern (e.g., Three-tier, Microservices, Hub-and-Spoke, Serverless, Event-driven, etc.)
+7. **Summary**: Brief description of what this architecture does
+"""
+
+# Format rules and JSON structure of one analysis; shared by the single and batch prompts
+_ANALYSIS_SCHEMA = """
+No markdown formatting, no code blocks, no backticks. Just pure JSON.
+Return compact JSON with no extra whitespace or newlines inside arrays/objects. Omit the "description" field when there is nothing to describe.
+
+Use this exact JSON structure for each analysis:
+{
+  "architecture_pattern": "Name of the architecture pattern",
+  "summary": "Brief summary of the architecture and its purpose",
+  "confidence": "high or medium or low",
+  "resources": [
+    {
+      "resource_name": "Name or identifier of the resource",
+      "resource_type": "Specific Azure service type (e.g., Azure App Service, Azure SQL Database)",
+      "category": "One of: Compute, Storage, Database, Networking, Security, Analytics, AI/ML, DevOps, Integration, Identity, Monitoring, Other",
+      "description": "Brief description of what this resource does in the architecture",
+      "connections": ["List of resource names this connects to"]
+    }
+  ]
+}
+
+Common Azure Categories:
+- **Compute**: Virtual Machines, App Service, Functions, Container Instances, Kubernetes Service, Batch
+- **Storage**: Blob Storage, File Storage, Queue Storage, Table Storage, Data Lake
+- **Database**: SQL Database, Cosmos DB, MySQL, PostgreSQL, Redis Cache
+- **Networking**: Virtual Network, Load Balancer, Application Gateway, VPN Gateway, Traffic Manager, Front Door, CDN
+- **Security**: Key Vault, Security Center, Active Directory, Azure Firewall
+- **Analytics**: Synapse Analytics, Data Factory, Stream Analytics, HDInsight, Databricks
+- **AI/ML**: Cognitive Services, Machine Learning, Bot Service
+- **DevOps**: DevOps, Pipelines, Repos, Artifacts
+- **Integration**: Logic Apps, Service Bus, Event Grid, Event Hubs, API Management
+- **Identity**: Active Directory, AD B2C, AD Domain Services
+- **Monitoring**: Monitor, Application Insights, Log Analytics
+- **Other**: Any services not fitting above categories
+"""
+
+# Prompt sent with every diagram; built once at import
+_ANALYSIS_PROMPT = """
+Analyze this Azure architecture diagram in detail and extract all information about Azure resources and their relationships.
+
+Please identify:""" + _ANALYSIS_CHECKLIST + """
+**IMPORTANT**: Return ONLY a single valid JSON object describing the diagram.""" + _ANALYSIS_SCHEMA + """
+Be thorough and identify every visible Azure resource in the diagram.
+"""
+
+# Values for top-level fields missing from a parsed analysis
+# ('resources' is filled separately so each result gets its own list)
+_DEFAULTS = {
+    'architecture_pattern': 'Not identified',
+    'summary': 'No summary available',
+    'confidence': 'medium'
+}
+
+# Markdown code fences (```json ... ```) that Gemini sometimes wraps around JSON
+_FENCE_RE = re.compile(r'```(?:json)?\s*|\s*```')
+# A line that opens a JSON object or array, after an unfenced preamble
+_JSON_LINE_RE = re.compile(r'^[ \t]*[\[{]', re.MULTILINE)
+
+# Digest of the API key the SDK is currently configured with. The SDK keeps
+# one process-wide default client, so every model bound while this key is
+# active shares its gRPC channel; switching keys builds a new client. Models
+# are bound to a client under _CONFIGURE_LOCK (see _bind_client), so a model
+# never picks up another key's client.
+_CONFIGURED_KEY: Optional[str] = None
+_CONFIGURE_LOCK = threading.RLock()
+
+# Gemini models shared by all analyzers, keyed by (API key digest, model name)
+_MODEL_CACHE: Dict[Tuple[str, str], genai.GenerativeModel] = {}
+_MODEL_CACHE_LOCK = threading.Lock()
+
+# Models for async requests, per event loop: a grpc.aio channel only works on
+# the loop it was created on. Entries go away with their loop.
+_ASYNC_MODEL_CACHE: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Dict[Tuple[str, str], genai.GenerativeModel]]" = weakref.WeakKeyDictionary()
+
+
+def _key_digest(api_key: str) -> str:
+    """
+    Digest an API key so caches never hold the key itself.
+    
+    Args:
+        api_key (str): Google Gemini API key
+        
+    Returns:
+        str: blake2b hex digest of the key
+    """
+    return hashlib.blake2b(api_key.encode('utf-8'), digest_size=16).hexdigest()
+
+
+def configure_genai(api_key: str) -> None:
+    """
+    Configure the Gemini SDK for an API key, reusing the existing client
+    and its gRPC channel when the key has not changed.
+    
+    Args:
+        api_key (str): Google Gemini API key
+    """
+    global _CONFIGURED_KEY
+    digest = _key_digest(api_key)
+    
+    with _CONFIGURE_LOCK:
+        if digest != _CONFIGURED_KEY:
+            # No transport: the SDK picks grpc for blocking clients and
+            # grpc_asyncio for async ones
+            genai.configure(api_key=api_key)
+            _CONFIGURED_KEY = digest
+
+
+def _bind_client(model: genai.GenerativeModel, api_key: str) -> None:
+    """
+    Attach the client for an API key to a model.
+    
+    The SDK would otherwise attach whatever default client is configured at
+    the model's first request, which may belong to a different key by then.
+    
+    Args:
+        model (genai.GenerativeModel): Model to bind
+        api_key (str): Google Gemini API key the model belongs to
+    """
+    with _CONFIGURE_LOCK:
+        configure_genai(api_key)
+        if model._client is None:
+            model._client = genai_client.get_default_generative_client()
+
+
+def list_models(api_key: str) -> List[str]:
+    """
+    List the Gemini models that support content generation for an API key.
+    
+    Args:
+        api_key (str): Google Gemini API key
+        
+    Returns:
+        list: Model names
+    """
+    # list_models is lazy; hold the lock until it is exhausted so it uses this key
+    with _CONFIGURE_LOCK:
+        configure_genai(api_key)
+        return [m.name for m in genai.list_models() if 'generateContent' in m.supported_generation_methods]
+
+
+def _get_model(api_key: str, model_name: str) -> genai.GenerativeModel:
+    """
+    Get a cached Gemini model bound to the client for its API key.
+    
+    Args:
+        api_key (str): Google Gemini API key
+        model_name (str): Resolved Gemini model identifier
+        
+    Returns:
+        genai.GenerativeModel: Model instance shared across analyzers
+    """
+    key = (_key_digest(api_key), model_name)
+    
+    with _MODEL_CACHE_LOCK:
+        model = _MODEL_CACHE.get(key)
+        if model is None:
+            model = genai.GenerativeModel(model_name)
+            _bind_client(model, api_key)
+            _MODEL_CACHE[key] = model
+    
+    return model
+
+
+def _get_async_model(api_key: str, model_name: str) -> genai.GenerativeModel:
+    """
+    Get a Gemini model for async requests on the running event loop.
+    
+    The SDK's default async client is process-wide and stops working once
+    the loop it was created on closes, so each loop gets its own client.
+    
+    Args:
+        api_key (str): Google Gemini API key
+        model_name (str): Resolved Gemini model identifier
+        
+    Returns:
+        genai.GenerativeModel: Model instance shared by analyzers on this loop
+    """
+    loop = asyncio.get_running_loop()
+    key = (_key_digest(api_key), model_name)
+    
+    with _MODEL_CACHE_LOCK:
+        models = _ASYNC_MODEL_CACHE.setdefault(loop, {})
+        model = models.get(key)
+        if model is None:
+            model = genai.GenerativeModel(model_name)
+            with _CONFIGURE_LOCK:
+                configure_genai(api_key)
+                model._async_client = genai_client._client_manager.make_client('generative_async')
+            models[key] = model
+    
+    return model
+
+
+# Successful analyses keyed by image content and model, evicted least recently used
+_RESULT_CACHE: "OrderedDict[bytes, Dict[str, Any]]" = OrderedDict()
+_RESULT_CACHE_SIZE = 128
+_RESULT_CACHE_LOCK = threading.Lock()
+
+
+class _JsonScanner:
+    """
+    Incrementally find where the first top-level JSON object or array ends,
+    so a streamed response can be parsed as soon as its JSON is complete.
+    
+    Text before the JSON is skipped: the value starts at the first bracket
+    after an opening code fence or, without a fence, at the first bracket
+    that begins a line. Brackets inside a preamble such as "Result [v1]:"
+    are ignored.
+    """
+    
+    def __init__(self):
+        self.depth = 0
+        self.in_string = False
+        self.escaped = False
+        self.fenced = False
+        self.line_start = True
+        self.ticks = 0
+        self.consumed = 0
+    
+    def feed(self, chunk: str) -> int:
+        """
+        Scan the next piece of streamed text.
+        
+        Args:
+            chunk (str): Text following everything fed so far
+            
+        Returns:
+            int: Offset just past the closing bracket, within all text fed so
+                far, or -1 if the JSON value is not complete yet
+        """
+        for i, ch in enumerate(chunk):
+            if self.in_string:
+                if self.escaped:
+                    self.escaped = False
+                elif ch == '\\':
+                    self.escaped = True
+                elif ch == '"':
+                    self.in_string = False
+                continue
+            
+            # Count backticks across chunks so a split fence is still seen
+            if ch == '`':
+                self.ticks += 1
+                if self.ticks == 3:
+                    # A fence inside the value means it was not JSON after all;
+                    # either way the JSON starts after this fence
+                    self.depth = 0
+                    self.fenced = True
+                continue
+            self.ticks = 0
+            
+            if self.depth:
+                if ch == '"':
+                    self.in_string = True
+                elif ch == '{' or ch == '[':
+                    self.depth += 1
+                elif ch == '}' or ch == ']':
+                    self.depth -= 1
+                    if self.depth == 0:
+                        return self.consumed + i + 1
+            elif ch == '{' or ch == '[':
+                if self.fenced or self.line_start:
+                    self.depth = 1
+            elif ch == '\n':
+                self.line_start = True
+            elif not ch.isspace():
+                self.line_start = False
+        
+        self.consumed += len(chunk)
+        return -1
+
+
+class AnalysisFailed(Exception):
+    """
+    An analysis came back unsuccessful.
+    
+    Defined here rather than in the Streamlit script, which gets a fresh
+    module (and so a fresh class) on every rerun.
+    """
+    
+    def __init__(self, result: Dict[str, Any]):
+        """
+        Args:
+            result (dict): The error response of the failed analysis
+        """
+        super().__init__(result.get('summary', 'Unknown error'))
+        self.result = result
+
 
 class DiagramAnalyzer:
     """
@@ -18,29 +333,32 @@ class DiagramAnalyzer:
     using Google's Gemini AI model.
     """
     
-    def __init__(self, api_key: str, model_name: str = "gemini-1.5-flash"):
+    # Map user-friendly names to actual model identifiers
+    MODEL_MAPPING = {
+        "gemini-1.5-flash": "gemini-1.5-flash-latest",
+        "gemini-1.5-pro": "gemini-1.5-pro-latest",
+        "gemini-1.5-flash-latest": "gemini-1.5-flash-latest",
+        "gemini-1.5-pro-latest": "gemini-1.5-pro-latest"
+    }
+    
+    def __init__(self, api_key: str, model_name: str = "gemini-1.5-flash", max_image_size: int = 1536):
         """
         Initialize the DiagramAnalyzer with API credentials.
         
         Args:
             api_key (str): Google Gemini API key
             model_name (str): Name of the Gemini model to use
+            max_image_size (int): Longest image side, in pixels, sent to the model
         """
         self.api_key = api_key
+        self.model_name = self.MODEL_MAPPING.get(model_name, "gemini-1.5-flash-latest")
+        self.max_image_size = max_image_size
         
-        # Map user-friendly names to actual model identifiers
-        model_mapping = {
-            "gemini-1.5-flash": "gemini-1.5-flash-latest",
-            "gemini-1.5-pro": "gemini-1.5-pro-latest",
-            "gemini-1.5-flash-latest": "gemini-1.5-flash-latest",
-            "gemini-1.5-pro-latest": "gemini-1.5-pro-latest"
-        }
-        
-        self.model_name = model_mapping.get(model_name, "gemini-1.5-flash-latest")
+        # Encoded content parts by id() of live PIL images, so retries skip re-encoding
+        self._encoded_images: Dict[int, Tuple[Tuple[str, Tuple[int, int]], Dict[str, Any]]] = {}
         
-        # Configure Gemini API
-        genai.configure(api_key=api_key)
-        self.model = genai.GenerativeModel(self.model_name)
+        # Configure Gemini API (cached per API key and model)
+        self.model = _get_model(api_key, self.model_name)
     
     def analyze_diagram(self, image: Image.Image) -> Dict[str, Any]:
         """
@@ -52,29 +370,274 @@ class DiagramAnalyzer:
         Returns:
             dict: Analysis results containing resources, patterns, and metadata
         """
+        # Repeat submissions of the same diagram are served from the cache
+        cache_key = self._result_cache_key(image)
+        cached = self._get_cached_result(cache_key)
+        if cached is not None:
+            return cached
+        
+        result = self.analyze_diagrams([image])[0]
+        self._cache_result(cache_key, result)
+        return result
+    
+    def analyze_diagrams(self, images: List[Image.Image]) -> List[Dict[str, Any]]:
+        """
+        Analyze several Azure architecture diagrams with a single Gemini request.
+        
+        Args:
+            images (list): The architecture diagram images to analyze
+            
+        Returns:
+            list: One analysis result per image, in the same order
+        """
+        if not images:
+            return []
+        
         try:
             # Create detailed prompt for Gemini
-            prompt = self._create_analysis_prompt()
+            if len(images) == 1:
+                prompt = _ANALYSIS_PROMPT
+            else:
+                prompt = self._create_batch_prompt(len(images))
             
             # Generate content using Gemini
-            response = self.model.generate_content([prompt, image])
+            response_text = self._call_model([prompt, *(self._encode_image(image) for image in images)])
             
             # Extract and parse the JSON response
-            result = self._parse_response(response.text)
+            if len(images) == 1:
+                results = [self._parse_response(response_text)]
+            else:
+                results = self._parse_batch_response(response_text, len(images))
+            
+            return self._add_metadata(results)
+            
+        except Exception as e:
+            error_message = self._error_message(e)
+        
+        return [self._create_error_response(error_message) for _ in images]
+    
+    async def analyze_diagram_async(self, image: Image.Image) -> Dict[str, Any]:
+        """
+        Analyze an Azure architecture diagram without blocking the event loop.
+        
+        Args:
+            image (PIL.Image.Image): The architecture diagram image to analyze
+            
+        Returns:
+            dict: Analysis results containing resources, patterns, and metadata
+        """
+        # Hashing and encoding are CPU-bound; keep them off the event loop so
+        # concurrent analyses prepare their images in parallel
+        cache_key = await asyncio.to_thread(self._result_cache_key, image)
+        cached = self._get_cached_result(cache_key)
+        if cached is not None:
+            return cached
+        
+        try:
+            part = await asyncio.to_thread(self._encode_image, image)
+            model = _get_async_model(self.api_key, self.model_name)
+            response = await model.generate_content_async([_ANALYSIS_PROMPT, part])
+            
+            result = self._add_metadata([self._parse_response(response.text)])[0]
+        except Exception as e:
+            return self._create_error_response(self._error_message(e))
+        
+        self._cache_result(cache_key, result)
+        return result
+    
+    async def analyze_many(self, images: List[Image.Image]) -> List[Dict[str, Any]]:
+        """
+        Analyze several diagrams with concurrent Gemini requests.
+        
+        Unlike analyze_diagrams, each image gets its own request, so one bad
+        response does not fail the others.
+        
+        Args:
+            images (list): The architecture diagram images to analyze
+            
+        Returns:
+            list: One analysis result per image, in the same order
+        """
+        return list(await asyncio.gather(*(self.analyze_diagram_async(image) for image in images)))
+    
+    def _result_cache_key(self, image: Image.Image) -> Optional[bytes]:
+        """
+        Build the result cache key for an image.
+        
+        Args:
+            image (PIL.Image.Image): The architecture diagram image
+            
+        Returns:
+            bytes: Digest of the image pixels, size, model name, size limit and
+                API key, or None if the image could not be read
+        """
+        # Hash in a fixed mode so the same diagram keys the same way
+        try:
+            pixels = image if image.mode == 'RGB' else image.convert('RGB')
+            data = pixels.tobytes()
+        except Exception:
+            # e.g. a truncated file: analyze uncached so the usual error response reports it
+            return None
+        
+        digest = hashlib.blake2b(data, digest_size=16)
+        digest.update(f"{image.size}|{self.model_name}|{self.max_image_size}|".encode('utf-8'))
+        # Results are never shared between API keys
+        digest.update(_key_digest(self.api_key).encode('utf-8'))
+        return digest.digest()
+    
+    def _get_cached_result(self, cache_key: Optional[bytes]) -> Optional[Dict[str, Any]]:
+        """
+        Look up a previous successful analysis.
+        
+        Args:
+            cache_key (bytes): Key from _result_cache_key, or None to skip the cache
+            
+        Returns:
+            dict: A copy of the cached analysis, or None if there is none
+        """
+        if cache_key is None:
+            return None
+        
+        with _RESULT_CACHE_LOCK:
+            cached = _RESULT_CACHE.get(cache_key)
+            if cached is None:
+                return None
+            _RESULT_CACHE.move_to_end(cache_key)
+        return copy.deepcopy(cached)
+    
+    def _cache_result(self, cache_key: Optional[bytes], result: Dict[str, Any]) -> None:
+        """
+        Remember an analysis for repeat submissions of the same diagram.
+        
+        Args:
+            cache_key (bytes): Key from _result_cache_key, or None to skip the cache
+            result (dict): The analysis result
+        """
+        # Only cache successes so failed analyses can be retried
+        if cache_key is None or not result['metadata']['success']:
+            return
+        
+        with _RESULT_CACHE_LOCK:
+            _RESULT_CACHE[cache_key] = copy.deepcopy(result)
+            if len(_RESULT_CACHE) > _RESULT_CACHE_SIZE:
+                _RESULT_CACHE.popitem(last=False)
+    
+    def _add_metadata(self, results: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """
+        Mark parsed analyses as successful.
+        
+        Args:
+            results (list): Parsed analyses
             
-            # Add metadata
+        Returns:
+            list: The same analyses with their metadata set
+        """
+        timestamp = self._get_timestamp()
+        for result in results:
             result['metadata'] = {
                 'success': True,
                 'model': self.model_name,
-                'timestamp': self._get_timestamp()
+                'timestamp': timestamp
             }
+        return results
+    
+    def _error_message(self, error: Exception) -> str:
+        """
+        Describe a failed analysis for the error response.
+        
+        Args:
+            error (Exception): The exception raised while analyzing
             
-            return result
+        Returns:
+            str: The error message
+        """
+        if isinstance(error, json.JSONDecodeError):
+            return f"Failed to parse AI response as JSON: {str(error)}"
+        return f"Analysis error: {str(error)}"
+    
+    def _call_model(self, contents: List[Any]) -> str:
+        """
+        Send prepared content parts to Gemini and collect the streamed reply.
+        
+        Streaming stops as soon as the reply's top-level JSON value is
+        complete, without waiting for any trailing text or code fence.
+        
+        Args:
+            contents (list): Prompt and encoded image parts
             
-        except json.JSONDecodeError as e:
-            return self._create_error_response(f"Failed to parse AI response as JSON: {str(e)}")
-        except Exception as e:
-            return self._create_error_response(f"Analysis error: {str(e)}")
+        Returns:
+            str: Response text up to the end of its JSON value
+        """
+        buf = io.StringIO()
+        scanner = _JsonScanner()
+        
+        for chunk in self.model.generate_content(contents, stream=True):
+            text = chunk.text
+            end = scanner.feed(text)
+            if end >= 0:
+                buf.write(text[:end - scanner.consumed])
+                break
+            buf.write(text)
+        
+        return buf.getvalue()
+    
+    def _encode_image(self, image: Image.Image) -> Dict[str, Any]:
+        """
+        Get the Gemini content part for an image, encoding it at most once.
+        
+        The encoded part is remembered for as long as the image object is
+        alive. Its mode and size are checked on reuse, so an image that was
+        resized or converted in place is encoded again.
+        
+        Args:
+            image (PIL.Image.Image): The architecture diagram image
+            
+        Returns:
+            dict: Gemini content part with the encoded image
+        """
+        image_id = id(image)
+        signature = (image.mode, image.size)
+        
+        cached = self._encoded_images.get(image_id)
+        if cached is not None and cached[0] == signature:
+            return cached[1]
+        
+        part = self._prepare_image(image)
+        if cached is None:
+            # Drop the entry when the image is garbage collected, before its id can be reused
+            weakref.finalize(image, self._encoded_images.pop, image_id, None)
+        self._encoded_images[image_id] = (signature, part)
+        return part
+    
+    def _prepare_image(self, image: Image.Image) -> Dict[str, Any]:
+        """
+        Downscale and JPEG-encode an image for upload to Gemini.
+        
+        Visual token count grows with resolution, and diagrams stay readable
+        well below 4K, so large images are shrunk to max_image_size first.
+        
+        Args:
+            image (PIL.Image.Image): The architecture diagram image
+            
+        Returns:
+            dict: Gemini content part with the encoded image
+        """
+        if image.mode in ('RGBA', 'LA') or (image.mode == 'P' and 'transparency' in image.info):
+            # Flatten transparency onto white; a plain RGB convert turns it black
+            rgba = image.convert('RGBA')
+            img = Image.new('RGB', rgba.size, (255, 255, 255))
+            img.paste(rgba, mask=rgba.getchannel('A'))
+        elif image.mode != 'RGB':
+            img = image.convert('RGB')
+        else:
+            img = image.copy()
+        
+        if max(img.size) > self.max_image_size:
+            img.thumbnail((self.max_image_size, self.max_image_size), Image.LANCZOS)
+        
+        buf = io.BytesIO()
+        img.save(buf, format='JPEG', quality=85)
+        return {'mime_type': 'image/jpeg', 'data': buf.getvalue()}
     
     def _create_analysis_prompt(self) -> str:
         """
@@ -83,53 +646,25 @@ class DiagramAnalyzer:
         Returns:
             str: The prompt text
         """
-        prompt = """
-Analyze this Azure architecture diagram in detail and extract all information about Azure resources and their relationships.
-
-Please identify:
-1. **All Azure Resources**: Look for service icons, labels, and text
-2. **Resource Types**: Specific Azure service names (e.g., App Service, Storage Account, SQL Database)
-3. **Resource Names**: Any custom names or labels given to resources
-4. **Categories**: Classify each resource (Compute, Storage, Database, Networking, Security, Analytics, AI/ML, DevOps, Integration, Identity, Monitoring, Other)
-5. **Connections**: Identify which resources connect to which (arrows, lines, or implied relationships)
-6. **Architecture Pattern**: Identify the overall pattern (e.g., Three-tier, Microservices, Hub-and-Spoke, Serverless, Event-driven, etc.)
-7. **Summary**: Brief description of what this architecture does
-
-**IMPORTANT**: Return ONLY valid JSON with no markdown formatting, no code blocks, no backticks. Just pure JSON.
-
-Use this exact JSON structure:
-{
-  "architecture_pattern": "Name of the architecture pattern",
-  "summary": "Brief summary of the architecture and its purpose",
-  "confidence": "high or medium or low",
-  "resources": [
-    {
-      "resource_name": "Name or identifier of the resource",
-      "resource_type": "Specific Azure service type (e.g., Azure App Service, Azure SQL Database)",
-      "category": "One of: Compute, Storage, Database, Networking, Security, Analytics, AI/ML, DevOps, Integration, Identity, Monitoring, Other",
-      "description": "Brief description of what this resource does in the architecture",
-      "connections": ["List of resource names this connects to"]
-    }
-  ]
-}
-
-Common Azure Categories:
-- **Compute**: Virtual Machines, App Service, Functions, Container Instances, Kubernetes Service, Batch
-- **Storage**: Blob Storage, File Storage, Queue Storage, Table Storage, Data Lake
-- **Database**: SQL Database, Cosmos DB, MySQL, PostgreSQL, Redis Cache
-- **Networking**: Virtual Network, Load Balancer, Application Gateway, VPN Gateway, Traffic Manager, Front Door, CDN
-- **Security**: Key Vault, Security Center, Active Directory, Azure Firewall
-- **Analytics**: Synapse Analytics, Data Factory, Stream Analytics, HDInsight, Databricks
-- **AI/ML**: Cognitive Services, Machine Learning, Bot Service
-- **DevOps**: DevOps, Pipelines, Repos, Artifacts
-- **Integration**: Logic Apps, Service Bus, Event Grid, Event Hubs, API Management
-- **Identity**: Active Directory, AD B2C, AD Domain Services
-- **Monitoring**: Monitor, Application Insights, Log Analytics
-- **Other**: Any services not fitting above categories
+        return _ANALYSIS_PROMPT
+    
+    def _create_batch_prompt(self, count: int) -> str:
+        """
+        Create the prompt for analyzing several diagrams in one request.
+        
+        Args:
+            count (int): Number of diagrams attached to the request
+            
+        Returns:
+            str: The prompt text
+        """
+        return f"""
+You are given {count} Azure architecture diagrams, attached in order. Analyze each diagram independently and in detail, extracting all information about its Azure resources and their relationships.
 
-Be thorough and identify every visible Azure resource in the diagram.
+For each diagram, identify:""" + _ANALYSIS_CHECKLIST + f"""
+**IMPORTANT**: Return ONLY a valid JSON array containing exactly {count} objects, one per diagram and in the same order as the diagrams.""" + _ANALYSIS_SCHEMA + """
+Be thorough and identify every visible Azure resource in each diagram.
 """
-        return prompt
     
     def _parse_response(self, response_text: str) -> Dict[str, Any]:
         """
@@ -141,25 +676,93 @@ Be thorough and identify every visible Azure resource in the diagram.
         Returns:
             dict: Parsed JSON response
         """
-        # Remove markdown code blocks if present
-        cleaned_text = re.sub(r'```json\s*|\s*```', '', response_text)
-        cleaned_text = cleaned_text.strip()
+        # Gemini usually follows the "pure JSON" instruction; parse that directly
+        # (JSON allows trailing whitespace, so only the front needs stripping)
+        text = response_text.lstrip()
+        if text[:1] == '{':
+            try:
+                return self._validate(_json_loads(text))
+            except json.JSONDecodeError:
+                pass
+        
+        return self._validate(self._load_json(response_text))
+    
+    def _parse_batch_response(self, response_text: str, count: int) -> List[Dict[str, Any]]:
+        """
+        Parse the AI model's response to a batch request.
+        
+        Args:
+            response_text (str): Raw response text from the AI model
+            count (int): Number of diagrams in the request
+            
+        Returns:
+            list: One parsed result per diagram
+        """
+        results = self._load_json(response_text)
+        
+        if not isinstance(results, list) or len(results) != count:
+            raise ValueError(f"Expected a JSON array of {count} analyses")
+        
+        return [self._validate(result) for result in results]
+    
+    def _load_json(self, response_text: str) -> Any:
+        """
+        Strip markdown code fences from the response and decode its JSON.
+        
+        Args:
+            response_text (str): Raw response text from the AI model
+            
+        Returns:
+            Any: Decoded JSON value
+        """
+        # Remove a surrounding markdown code block if present: slice from the
+        # first fence to the closing one, then strip once. JSON strings cannot
+        # hold a raw newline, so a fence at the start of a line closes the
+        # block; a response cut off at the end of its JSON has no closing
+        # fence and is sliced to the end.
+        start = response_text.find('```')
+        if start == -1:
+            cleaned_text = response_text.strip()
+            if cleaned_text[:1] not in ('{', '['):
+                # Skip a preamble such as "Result [v1]:" before the JSON line
+                match = _JSON_LINE_RE.search(cleaned_text)
+                if match:
+                    cleaned_text = cleaned_text[match.start():].lstrip()
+        else:
+            start += 3
+            if response_text[start:start + 4].lower() == 'json':
+                start += 4
+            end = response_text.find('\n```', start)
+            if end == -1:
+                # Closing fence on the JSON's own line, or none at all
+                end = len(response_text.rstrip())
+                if end - 3 >= start and response_text.endswith('```', 0, end):
+                    end -= 3
+            cleaned_text = response_text[start:end].strip()
         
         # Parse JSON
-        result = json.loads(cleaned_text)
-        
-        # Validate structure
-        if 'resources' not in result:
-            result['resources'] = []
-        if 'architecture_pattern' not in result:
-            result['architecture_pattern'] = 'Not identified'
-        if 'summary' not in result:
-            result['summary'] = 'No summary available'
-        if 'confidence' not in result:
-            result['confidence'] = 'medium'
+        try:
+            result = _json_loads(cleaned_text)
+        except json.JSONDecodeError:
+            # Unusual layouts (e.g. several fences): strip every fence and retry
+            if '```' not in response_text:
+                raise
+            result = _json_loads(_FENCE_RE.sub('', response_text).strip())
         
         return result
     
+    def _validate(self, result: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Fill in any top-level fields missing from a parsed analysis.
+        
+        Args:
+            result (dict): Parsed analysis
+            
+        Returns:
+            dict: The analysis with all expected fields present
+        """
+        return {'resources': [], **_DEFAULTS, **result}
+    
     def _create_error_response(self, error_message: str) -> Dict[str, Any]:
         """
         Create a standardized error response.
@@ -187,10 +790,9 @@ Be thorough and identify every visible Azure resource in the diagram.
         Get current timestamp in ISO format.
         
         Returns:
-            str: ISO formatted timestamp
+            str: ISO formatted UTC timestamp
         """
-        from datetime import datetime
-        return datetime.now().isoformat()
+        return datetime.now(timezone.utc).isoformat()
     
     def get_resources_by_category(self, result: Dict[str, Any]) -> Dict[str, List[Dict]]:
         """
@@ -202,18 +804,7 @@ Be thorough and identify every visible Azure resource in the diagram.
         Returns:
             dict: Dictionary with categories as keys and lists of resources as values
         """
-        categories = {}
-        
-        for resource in result.get('resources', []):
-            category = resource.get('category', 'Other')
-            
-            if category not in categories:
-                categories[category] = []
-            
-            categories[category].append(resource)
-        
-        # Sort categories alphabetically
-        return dict(sorted(categories.items()))
+        return self._fused_analyze(result.get('resources', ()))['by_category']
     
     def get_resource_statistics(self, result: Dict[str, Any]) -> Dict[str, Any]:
         """
@@ -225,31 +816,7 @@ Be thorough and identify every visible Azure resource in the diagram.
         Returns:
             dict: Statistics including counts, categories, connections
         """
-        resources = result.get('resources', [])
-        
-        stats = {
-            'total_resources': len(resources),
-            'total_categories': len(set(r.get('category', 'Other') for r in resources)),
-            'total_connections': sum(len(r.get('connections', [])) for r in resources),
-            'resources_by_category': {},
-            'most_connected_resource': None,
-            'confidence': result.get('confidence', 'N/A')
-        }
-        
-        # Count resources by category
-        for resource in resources:
-            category = resource.get('category', 'Other')
-            stats['resources_by_category'][category] = stats['resources_by_category'].get(category, 0) + 1
-        
-        # Find most connected resource
-        if resources:
-            most_connected = max(resources, key=lambda r: len(r.get('connections', [])))
-            stats['most_connected_resource'] = {
-                'name': most_connected.get('resource_name', 'Unknown'),
-                'connections': len(most_connected.get('connections', []))
-            }
-        
-        return stats
+        return self._build_statistics(result, self._fused_analyze(result.get('resources', ())))
     
     def export_to_dict(self, result: Dict[str, Any]) -> Dict[str, Any]:
         """
@@ -261,11 +828,78 @@ Be thorough and identify every visible Azure resource in the diagram.
         Returns:
             dict: Cleaned and formatted result
         """
+        resources = result.get('resources', [])
+        fused = self._fused_analyze(resources)
+        
         return {
             'architecture_pattern': result.get('architecture_pattern', 'Not identified'),
             'summary': result.get('summary', 'No summary available'),
             'confidence': result.get('confidence', 'N/A'),
-            'resources': result.get('resources', []),
-            'statistics': self.get_resource_statistics(result),
+            'resources': resources,
+            'statistics': self._build_statistics(result, fused),
             'metadata': result.get('metadata', {})
-        }
\ No newline at end of file
+        }
+    
+    def _fused_analyze(self, resources: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """
+        Walk the resources once, collecting everything the public accessors need.
+        
+        Args:
+            resources (list): The analyzed resources
+            
+        Returns:
+            dict: Resources grouped by sorted category, total resource and
+                connection counts, and the most connected resource
+        """
+        by_category = defaultdict(list)
+        total_connections = 0
+        most_connected = None
+        most_connections = -1
+        
+        for resource in resources:
+            by_category[resource.get('category', 'Other')].append(resource)
+            
+            n_connections = len(resource.get('connections') or ())
+            total_connections += n_connections
+            if n_connections > most_connections:
+                most_connected, most_connections = resource, n_connections
+        
+        return {
+            # Sort categories alphabetically
+            'by_category': {category: by_category[category] for category in sorted(by_category)},
+            'total_resources': len(resources),
+            'total_connections': total_connections,
+            'most_connected': most_connected,
+            'most_connections': most_connections
+        }
+    
+    def _build_statistics(self, result: Dict[str, Any], fused: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Assemble the statistics dictionary from a fused resource pass.
+        
+        Args:
+            result (dict): The analysis result
+            fused (dict): Output of _fused_analyze for the result's resources
+            
+        Returns:
+            dict: Statistics including counts, categories, connections
+        """
+        by_category = fused['by_category']
+        most_connected = fused['most_connected']
+        
+        stats = {
+            'total_resources': fused['total_resources'],
+            'total_categories': len(by_category),
+            'total_connections': fused['total_connections'],
+            'resources_by_category': {category: len(resources) for category, resources in by_category.items()},
+            'most_connected_resource': None,
+            'confidence': result.get('confidence', 'N/A')
+        }
+        
+        if most_connected is not None:
+            stats['most_connected_resource'] = {
+                'name': most_connected.get('resource_name', 'Unknown'),
+                'connections': fused['most_connections']
+            }
+        
+        return stats
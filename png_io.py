@@ -0,0 +1,119 @@
+"""
+Architecture Diagram Upload Helpers - Shared PNG I/O Module
+This module provides cached decoding, preview and download helpers for PNG
+diagrams uploaded through Streamlit, shared by the viewer and analyzer apps.
+"""
+
+import hashlib
+import io
+from typing import Tuple
+
+import streamlit as st
+from PIL import Image
+
+# Longest side of the on-screen preview sent to the browser
+PREVIEW_MAX_SIZE = 1400
+
+
+def content_key(raw: bytes) -> str:
+    """
+    Compute the cache key for uploaded image bytes.
+
+    Args:
+        raw (bytes): Uploaded file contents
+
+    Returns:
+        str: blake2b hex digest of the contents
+    """
+    return hashlib.blake2b(raw, digest_size=16).hexdigest()
+
+
+@st.cache_resource(show_spinner=False, max_entries=16)
+def decode_png(key: str, _raw: bytes) -> Image.Image:
+    """
+    Decode uploaded image bytes once and share the image across reruns.
+
+    The raw bytes are not hashed by Streamlit; ``key`` identifies them.
+
+    Args:
+        key (str): Content key of the bytes (see ``content_key``)
+        _raw (bytes): Uploaded file contents
+
+    Returns:
+        PIL.Image.Image: The fully decoded image
+    """
+    image = Image.open(io.BytesIO(_raw))
+    image.load()
+    return image
+
+
+def load_png(uploaded_file) -> Tuple[Image.Image, bytes, str]:
+    """
+    Read, key and decode a Streamlit upload.
+
+    The content key is computed once per upload and reused on widget reruns.
+
+    Args:
+        uploaded_file (UploadedFile): File returned by ``st.file_uploader``
+
+    Returns:
+        tuple: (decoded image, raw bytes, content key)
+    """
+    raw = uploaded_file.getvalue()
+
+    file_id = getattr(uploaded_file, 'file_id', None)
+    state = st.session_state
+    if file_id is None or state.get('png_io_file_id') != file_id:
+        state['png_io_key'] = content_key(raw)
+        state['png_io_file_id'] = file_id
+    key = state['png_io_key']
+
+    return decode_png(key, raw), raw, key
+
+
+@st.cache_data(show_spinner=False, max_entries=16)
+def preview_bytes(key: str, _raw: bytes, max_size: int = PREVIEW_MAX_SIZE) -> bytes:
+    """
+    Downscale and re-encode an upload once for the on-screen preview.
+
+    Args:
+        key (str): Content key of the bytes
+        _raw (bytes): Uploaded file contents
+        max_size (int): Longest side of the preview in pixels
+
+    Returns:
+        bytes: PNG bytes for ``st.image``; the upload itself if already small enough
+    """
+    image = decode_png(key, _raw)
+    if max(image.size) <= max_size:
+        return _raw
+
+    preview = image.copy()
+    preview.thumbnail((max_size, max_size), Image.LANCZOS)
+    out = io.BytesIO()
+    # Fast, light compression - this only travels to the browser
+    preview.save(out, format='PNG', optimize=False, compress_level=1)
+    return out.getvalue()
+
+
+@st.cache_data(show_spinner=False, max_entries=16)
+def download_bytes(key: str, _raw: bytes) -> bytes:
+    """
+    Return PNG bytes for downloading an upload.
+
+    PNG uploads are returned untouched; anything else is re-encoded once.
+
+    Args:
+        key (str): Content key of the bytes
+        _raw (bytes): Uploaded file contents
+
+    Returns:
+        bytes: PNG file contents
+    """
+    image = decode_png(key, _raw)
+    if image.format == 'PNG':
+        return _raw
+
+    out = io.BytesIO()
+    image.save(out, format='PNG', optimize=False, compress_level=1)
+    return out.getvalue()